@@ -5,10 +5,22 @@ import psycopg2
 import logging
 import os
 import re
+import json
+import hashlib
+import time
+import uuid
+import asyncio
+import tempfile
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Body
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
-from fastapi.responses import FileResponse
-from typing import Optional, List, Dict, Any
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from typing import Optional, List, Dict, Any, Union, NamedTuple, Tuple
 from enum import Enum
 
 # --- 1. 初始化設定 ---
@@ -20,6 +32,30 @@ try:
 except Exception as e:
     logging.warning(f"Could not initialize Oracle client in Thick Mode: {e}. The application will continue in Thin Mode.")
 
+# Oracle 用戶端 statement cache，搭配綁定變數可重複使用已解析的游標，避免 hard parse
+oracledb.defaults.stmtcachesize = int(os.environ.get("ORACLE_STMT_CACHE_SIZE", "50"))
+
+# SQL 唯讀檢查結果快取筆數 (以 SQL 雜湊值為 key，只保存檢查結論)，重複執行的報表 SQL 不必重新掃描
+SQL_LEX_CACHE_SIZE = int(os.environ.get("SQL_LEX_CACHE_SIZE", "256"))
+
+# 非同步查詢工作 (Job) 設定，可透過環境變數調整
+JOB_MAX_CONCURRENT = int(os.environ.get("JOB_MAX_CONCURRENT", "4"))        # 同時執行中的工作上限
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "1800"))           # 工作完成後保留多久 (秒)
+JOB_MAX_ROWS = int(os.environ.get("JOB_MAX_ROWS", "1000000"))              # 單一工作可抓取的最大筆數
+JOB_FETCH_BATCH = int(os.environ.get("JOB_FETCH_BATCH", "1000"))           # 每次 fetchmany 的筆數
+JOB_SPILL_DIR = os.environ.get("JOB_SPILL_DIR") or None                    # 結果暫存檔目錄，預設為系統暫存目錄
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "1")) # SSE 進度推送間隔 (秒)
+JOB_CLEANUP_INTERVAL = 60                                                  # 過期工作清理間隔 (秒)
+JOB_INDEX_STRIDE = 1000                                                    # 每隔多少筆記錄一次暫存檔位移，供分頁讀取
+
+# 查詢結果記憶體預算設定 (bytes)，避免多個大型查詢同時進行時撐爆容器記憶體
+RESULT_MEMORY_BUDGET = int(os.environ.get("RESULT_MEMORY_BUDGET", str(512 * 1024 * 1024)))  # 全域預算
+RESULT_MAX_BYTES = min(int(os.environ.get("RESULT_MAX_BYTES", str(64 * 1024 * 1024))), RESULT_MEMORY_BUDGET)  # 單一結果上限，超過即截斷
+RESULT_BUDGET_WAIT = float(os.environ.get("RESULT_BUDGET_WAIT", "30"))     # 預算不足時最多等待秒數
+RESULT_FETCH_BATCH = 500                                                   # 同步查詢每次 fetchmany 的筆數
+RESULT_COPY_FACTOR = 4                                                     # 結果在記憶體中同時存在 tuple、dict、jsonable_encoder 副本、JSON 四份
+QUERY_MAX_WORKERS = int(os.environ.get("QUERY_MAX_WORKERS", "8"))          # 同步查詢專用執行緒數，等待預算時不佔用其他端點的執行緒
+
 # --- 2. Pydantic 模型定義 ---
 
 class DbType(str, Enum):
@@ -40,36 +76,296 @@ class DbConnectionBase(BaseModel):
 class SQLQuery(DbConnectionBase):
     sql: str
     max_rows: int = Field(200, gt=0, le=10000)
+    # 綁定變數：SQL 中一律使用 Oracle 風格的 :name 或 :1 佔位符，
+    # dict 對應具名變數，list 依序對應 :1, :2, ...
+    params: Optional[Union[Dict[str, Any], List[Any]]] = None
+
+class JobQuery(SQLQuery):
+    # 背景工作的結果會暫存到磁碟，因此允許比同步查詢更大的筆數
+    max_rows: int = Field(10000, gt=0, le=JOB_MAX_ROWS)
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    ERROR = "error"
+    CANCELLED = "cancelled"
 
 # --- 3. 核心邏輯與輔助函式 ---
 
-def validate_read_only_sql(sql: str):
+class SqlToken(NamedTuple):
+    kind: str   # comment, string, ident, bind, semicolon
+    start: int
+    end: int
+
+class SqlLexResult(NamedTuple):
+    tokens: Tuple[SqlToken, ...]
+    error: Optional[str] = None  # 無法確定語句邊界時 (未結束或不支援的引號、註解) 的說明
+
+# 各資料庫的引號規則不同，依 db_type 組出各自的 regex：
+# - 共通：'...' 字串 ('' 跳脫)、"..." 識別字 ("" 跳脫)、-- 與 /* */ 註解
+# - SQL Server：[...] 識別字 (]] 跳脫)，/* */ 可巢狀
+# - PostgreSQL：E'...' 反斜線跳脫字串、$tag$...$tag$ 字串，/* */ 可巢狀；[ 是陣列下標而非引號
+# - Oracle：q'[...]' 等替代引號字串
+# - SQLite：[...] 與 `...` 識別字
+# 結尾的 (?!quote) 避免 regex 回溯把跳脫用的成對引號拆開 (例如把 [a]] 當成 [a] 加上多餘的 ])。
+# /* */、$tag$ 與 q' 只比對開頭，結尾以 str.find 尋找 (_quoted_end)。
+# 引號比對失敗時不會退回其他規則重試，而是直接判定無法解析：掃描因此維持線性時間，
+# 也不會把剩下的 SQL 當成字串或註解略過。
+_STANDARD_STRING = r"'[^']*(?:''[^']*)*'(?!')"
+_DOUBLE_QUOTED_IDENT = r'"[^"]*(?:""[^"]*)*"(?!")'
+_PG_E_PREFIX = r"(?<=[eE])(?<![\w$][eE])"
+_PG_DOLLAR_OPEN = r"(?<![\w$])\$(?:[A-Za-z_]\w*)?\$"
+_ORACLE_Q_PREFIX = r"(?<=[qQ])(?:(?<![\w$#][qQ])|(?<=[nN][qQ])(?<![\w$#][nN][qQ]))"
+_ORACLE_Q_CLOSE = {"[": "]", "{": "}", "(": ")", "<": ">"}
+
+_NESTED_COMMENT_DIALECTS = (DbType.MSSQL, DbType.POSTGRES)
+_READ_ONLY_STARTERS = ("SELECT", "WITH", "USE")
+
+class _DialectLexRules(NamedTuple):
+    quotes: str           # 會開始字串或識別字的字元 (regex 字元集合內容)
+    strings: List[str]
+    idents: List[str]
+    openers: List[str]    # 結尾交給 _quoted_end 的開頭
+    plain: List[str]      # 停止字元中不具結構意義的用法
+
+def _dialect_lex_rules(db_type: DbType) -> _DialectLexRules:
+    quotes = "'\"`"
+    strings = [_STANDARD_STRING]
+    idents = [_DOUBLE_QUOTED_IDENT]
+    openers = [r"/\*"]
+    plain = []
+
+    if db_type == DbType.MSSQL:
+        quotes += r"\["
+        idents.append(r"\[[^\]]*(?:\]\][^\]]*)*\](?!\])")
+    elif db_type == DbType.POSTGRES:
+        quotes += "$"
+        strings = [_PG_E_PREFIX + r"'(?:[^'\\]|\\.|'')*'(?!')", f"(?!{_PG_E_PREFIX})" + _STANDARD_STRING]
+        openers.append(_PG_DOLLAR_OPEN)
+        plain.append(r"(?<=[\w$])\$|\$(?!(?:[A-Za-z_]\w*)?\$)")
+    elif db_type == DbType.ORACLE:
+        strings = [f"(?!{_ORACLE_Q_PREFIX})" + _STANDARD_STRING]
+        openers.append(_ORACLE_Q_PREFIX + "'")
+    elif db_type == DbType.SQLITE:
+        quotes += r"\["
+        idents += [r"\[[^\]]*\]", r"`[^`]*(?:``[^`]*)*`(?!`)"]
+
+    return _DialectLexRules(quotes, strings, idents, openers, plain)
+
+def _build_statement_body_re(db_type: DbType):
+    # 一次 match 略過語句內容 (含字串、識別字與 -- 註解)，停在 ; 、需要 _quoted_end 的開頭或無法解析的引號
+    rules = _dialect_lex_rules(db_type)
+    parts = [f"[^-/;{rules.quotes}]+", r"--[^\n]*", "-(?!-)", r"/(?!\*)"] + rules.strings + rules.idents + rules.plain
+    return re.compile(f"(?:{'|'.join(parts)})*", re.DOTALL)
+
+def _build_sql_lex_re(db_type: DbType):
+    # 只比對具結構意義的 token，其餘一般文字由開頭的 lookahead 讓 regex 引擎快速略過
+    rules = _dialect_lex_rules(db_type)
+    alternatives = [
+        r"(?P<comment>--[^\n]*)",
+        f"(?P<opener>{'|'.join(rules.openers)})",
+        f"(?P<string>{'|'.join(rules.strings)})",
+        f"(?P<ident>{'|'.join(rules.idents)})",
+        r"(?P<cast>::)",
+        r"(?P<bind>:[A-Za-z0-9_]+)",  # 與前端一致，名稱只用 ASCII 字元
+        r"(?P<semicolon>;)",
+        f"(?P<invalid>[{rules.quotes.replace('$', '')}])",
+    ]
+    return re.compile(f"(?=[-/;:{rules.quotes}])(?:{'|'.join(alternatives)})", re.DOTALL)
+
+_SQL_LEX_RES = {db_type: _build_sql_lex_re(db_type) for db_type in DbType}
+_STATEMENT_BODY_RES = {db_type: _build_statement_body_re(db_type) for db_type in DbType}
+_PG_DOLLAR_OPEN_RE = re.compile(_PG_DOLLAR_OPEN)
+_ORACLE_Q_OPEN_RE = re.compile(_ORACLE_Q_PREFIX + r"'(\S)")
+_BLOCK_COMMENT_DELIM_RE = re.compile(r"/\*|\*/")
+_STATEMENT_GAP_RE = re.compile(r"(?:\s+|--[^\n]*)*")
+_WORD_RE = re.compile(r"[A-Za-z_]\w*")
+
+_verdict_cache: "OrderedDict[Tuple[DbType, bytes], Optional[str]]" = OrderedDict()
+_verdict_cache_lock = threading.Lock()
+
+def _block_comment_end(sql: str, pos: int, nested: bool) -> int:
+    """從 /* 之後的位置起算註解的結尾；沒有結束時回傳 -1。"""
+    if not nested:
+        end = sql.find("*/", pos)
+        return end + 2 if end >= 0 else -1
+    depth = 1
+    for delim in _BLOCK_COMMENT_DELIM_RE.finditer(sql, pos):
+        depth += 1 if delim.group() == "/*" else -1
+        if depth == 0:
+            return delim.end()
+    return -1
+
+def _quoted_end(sql: str, pos: int, db_type: DbType) -> int:
+    """計算位於 pos 的 /* 註解、$tag$ 字串或 q' 字串的結尾；不是這些開頭或沒有結束時回傳 -1。"""
+    if sql.startswith("/*", pos):
+        return _block_comment_end(sql, pos + 2, db_type in _NESTED_COMMENT_DIALECTS)
+    if db_type == DbType.POSTGRES:
+        tag = _PG_DOLLAR_OPEN_RE.match(sql, pos)
+        if tag:
+            end = sql.find(tag.group(), tag.end())
+            return end + len(tag.group()) if end >= 0 else -1
+    elif db_type == DbType.ORACLE:
+        opening = _ORACLE_Q_OPEN_RE.match(sql, pos)
+        if opening:
+            delim = opening.group(1)
+            end = sql.find(_ORACLE_Q_CLOSE.get(delim, delim) + "'", opening.end())
+            return end + 2 if end >= 0 else -1
+    return -1
+
+def _unparseable(sql: str, pos: int) -> str:
+    quote = sql[pos:pos + 2] if sql.startswith(("/*", "$"), pos) else sql[pos]
+    return f"無法解析位置 {pos} 的 {quote}：未結束或不支援的引號、註解。"
+
+def lex_sql(sql: str, db_type: DbType) -> SqlLexResult:
+    """
+    依 db_type 的引號規則單次掃描 SQL，回傳字串、引號識別字、註解、分號與綁定變數 token；
+    無法確定語句邊界時 error 會有說明。供綁定變數轉換使用，結果不快取。
+    """
+    pattern = _SQL_LEX_RES[db_type]
+    tokens = []
+    match = pattern.search(sql)
+    while match:
+        kind, start, end = match.lastgroup, match.start(), match.end()
+        if kind == "opener":
+            kind = "comment" if sql.startswith("/*", start) else "string"
+            end = _quoted_end(sql, start, db_type)
+        if kind == "invalid" or end < 0:
+            return SqlLexResult(tuple(tokens), _unparseable(sql, start))
+        if kind != "cast":
+            tokens.append(SqlToken(kind, start, end))
+        match = pattern.search(sql, end)
+    return SqlLexResult(tuple(tokens))
+
+def _read_only_verdict(sql: str, db_type: DbType) -> Optional[str]:
+    """
+    逐一檢查每個語句的第一個詞，語句內容以單次 regex match 略過；
+    回傳拒絕的原因，唯讀查詢則回傳 None。
+    """
+    body_re = _STATEMENT_BODY_RES[db_type]
+    length = len(sql)
+    pos = 0
+    in_statement = False
+    seen_statement = False
+
+    while True:
+        if in_statement:
+            pos = body_re.match(sql, pos).end()
+        else:
+            pos = _STATEMENT_GAP_RE.match(sql, pos).end()
+        if pos >= length:
+            break
+        char = sql[pos]
+        if char == ";":
+            in_statement = False
+            pos += 1
+            continue
+        if not in_statement and not sql.startswith("/*", pos):
+            word = _WORD_RE.match(sql, pos)
+            keyword = word.group().upper() if word else char
+            if keyword not in _READ_ONLY_STARTERS:
+                return f"僅允許執行唯讀查詢 (SELECT 或 WITH 開頭)。偵測到不被允許的指令 '{keyword[:64]}'。"
+            in_statement = seen_statement = True
+            pos = word.end()
+            continue
+        end = _quoted_end(sql, pos, db_type)
+        if end < 0:
+            return f"SQL 語法無法安全檢查。{_unparseable(sql, pos)}"
+        pos = end
+
+    return None if seen_statement else "SQL 語句不可為空。"
+
+def validate_read_only_sql(sql: str, db_type: DbType):
     """
     檢查 SQL 語句是否為唯讀查詢。
     防止執行 DML (INSERT, UPDATE, DELETE) 和 DDL (CREATE, ALTER, DROP, TRUNCATE) 操作。
+    字串、引號識別字與註解中的分號或關鍵字不會影響判斷；無法確定語句邊界的 SQL 一律拒絕。
+    檢查結果 (只保留拒絕原因) 依 (db_type, SQL 雜湊值) 做 LRU 快取，重複執行的報表 SQL 不必重新掃描。
     """
-    # 移除 C-style 註解 /* ... */
-    sql_no_comments = re.sub(r'/\*.*?\*/', '', sql, flags=re.DOTALL)
-    # 移除 SQL-style 註解 -- ...
-    sql_no_comments = re.sub(r'--.*', '', sql_no_comments)
-    
-    # 以分號分割多個語句，並過濾掉空字串
-    statements = [s.strip() for s in sql_no_comments.split(';') if s.strip()]
-
-    if not statements:
-        raise HTTPException(status_code=400, detail="SQL 語句不可為空。")
-
-    # 檢查每一個獨立的語句
-    for statement in statements:
-        # 取得第一個詞並轉為大寫
-        first_word = statement.split()[0].upper()
-        allowed_starters = ["SELECT", "WITH","USE"]
-        
-        if first_word not in allowed_starters:
-            raise HTTPException(
-                status_code=400,
-                detail=f"僅允許執行唯讀查詢 (SELECT 或 WITH 開頭)。偵測到不被允許的指令 '{first_word}'。"
-            )
+    key = (db_type, hashlib.blake2b(sql.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+    with _verdict_cache_lock:
+        cached = key in _verdict_cache
+        if cached:
+            _verdict_cache.move_to_end(key)
+            detail = _verdict_cache[key]
+
+    if not cached:
+        detail = _read_only_verdict(sql, db_type)
+        with _verdict_cache_lock:
+            _verdict_cache[key] = detail
+            while len(_verdict_cache) > SQL_LEX_CACHE_SIZE:
+                _verdict_cache.popitem(last=False)
+
+    if detail:
+        raise HTTPException(status_code=400, detail=detail)
+
+def prepare_binds(sql: str, db_type: DbType, params):
+    """
+    將 :name 佔位符轉換為各資料庫驅動的 paramstyle，回傳 (sql, params)。
+    Oracle 原生支援 :name，直接傳遞；PostgreSQL 轉為 %(name)s，SQL Server 轉為 ? 並依出現順序排列參數。
+    list 參數在所有資料庫都依名稱對應 :1, :2, ...，不依佔位符出現的順序。
+    提供的參數若在 SQL 中找不到對應的佔位符 (例如位於字串或註解中)，視為錯誤而不是默默忽略。
+    """
+    if not params:
+        return sql, None
+
+    lexed = lex_sql(sql, db_type)
+    if lexed.error:
+        raise HTTPException(status_code=400, detail=lexed.error)
+
+    positional = isinstance(params, list)
+    values = {str(i + 1): v for i, v in enumerate(params)} if positional else params
+    names = []
+    parts = []
+    pos = 0
+
+    # psycopg2 帶參數執行時，SQL 中所有的 % 都必須跳脫為 %%
+    escape = (lambda text: text.replace('%', '%%')) if db_type == DbType.POSTGRES else (lambda text: text)
+
+    for token in lexed.tokens:
+        if token.kind != "bind":
+            continue
+        name = sql[token.start + 1:token.end]
+        # PostgreSQL 的陣列切片 arr[1:2] 與 :2 寫法相同，數字名稱只在使用 list 參數時才視為佔位符
+        if db_type == DbType.POSTGRES and not positional and name.isdigit():
+            continue
+        names.append(name)
+        parts.append(escape(sql[pos:token.start]))
+        parts.append("?" if db_type == DbType.MSSQL else f"%({name})s")
+        pos = token.end
+    parts.append(escape(sql[pos:]))
+    converted = "".join(parts)
+
+    if positional and not all(name.isdigit() for name in names):
+        raise HTTPException(status_code=400, detail="使用 list 參數時，佔位符必須是 :1, :2, ... 等數字名稱。")
+    if db_type == DbType.ORACLE and not positional:
+        # Oracle 未加引號的綁定變數名稱不分大小寫
+        names = [name.upper() for name in names]
+        values = {str(key).upper(): value for key, value in params.items()}
+
+    missing = sorted(set(name for name in names if name not in values))
+    if missing:
+        raise HTTPException(status_code=400, detail=f"缺少綁定變數的值: {', '.join(missing)}")
+    unused = [name for name in values if name not in names]
+    if unused:
+        raise HTTPException(status_code=400, detail=f"SQL 中找不到下列綁定變數的佔位符: {', '.join(unused)}")
+
+    if db_type == DbType.ORACLE:
+        return sql, values if positional else params
+    if db_type == DbType.MSSQL:
+        return converted, [values[name] for name in names]
+    return converted, {name: values[name] for name in names}
+
+def execute_sql(cursor, query: SQLQuery):
+    """
+    以綁定變數執行查詢；沒有參數時維持原本的單一 SQL 字串執行。
+    """
+    sql, params = prepare_binds(query.sql, query.db_type, query.params)
+    if params is None:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql, params)
 
 def get_db_engine(conn_details: DbConnectionBase):
     """
@@ -138,10 +434,425 @@ def get_db_engine(conn_details: DbConnectionBase):
         raise HTTPException(status_code=400, detail="不支援的資料庫類型")
 
 
+# --- 3-1. 查詢結果記憶體預算 ---
+# 依資料列內容估算在途結果所佔的記憶體，並對全域預算做登記；預算用盡時，
+# 後續的抓取會等待其他查詢釋放 (背壓)，等待逾時則回傳 503。
+
+class MemoryBudget:
+    """
+    以 bytes 計算的全域記憶體預算，可跨執行緒使用。
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: float = RESULT_BUDGET_WAIT) -> int:
+        """
+        登記 nbytes (不超過總預算)，預算不足時等待，逾時拋出 503。回傳實際登記的 bytes。
+        """
+        nbytes = min(nbytes, self.limit)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.used + nbytes > self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise HTTPException(
+                            status_code=503,
+                            detail=f"伺服器查詢結果記憶體已滿 ({self.used / 1048576:.1f} / {self.limit / 1048576:.1f} MB)，請稍後再試。"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+        return nbytes
+
+    def try_acquire(self, nbytes: int) -> bool:
+        """
+        不等待的登記；預算不足時回傳 False。已持有預算的呼叫端必須使用此方法，避免互相等待。
+        """
+        with self._cond:
+            if self.used + nbytes > self.limit:
+                self.rejected += 1
+                return False
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+        return True
+
+    def release(self, nbytes: int):
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "budget_bytes": self.limit,
+                "used_bytes": self.used,
+                "peak_bytes": self.peak,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+                "max_result_bytes": RESULT_MAX_BYTES,
+            }
+
+result_budget = MemoryBudget(RESULT_MEMORY_BUDGET)
+
+class BudgetedJSONResponse(JSONResponse):
+    """
+    回應本文送出後 (或連線中斷時) 才釋放記憶體預算的 JSONResponse，
+    讓序列化後的 JSON 本文在送出前也計入預算。
+    """
+    def __init__(self, content: Any, reserved: int):
+        super().__init__(content=content)
+        self.reserved = reserved
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            result_budget.release(self.reserved)
+            self.reserved = 0
+
+def estimate_row_bytes(row) -> int:
+    """
+    粗估一筆資料列在記憶體中的大小 (含 RESULT_COPY_FACTOR 份複本)。
+    """
+    size = sys.getsizeof(row)
+    for value in row:
+        if isinstance(value, (str, bytes, bytearray)):
+            size += sys.getsizeof(value)
+        elif value is not None:
+            size += 32
+    return size * RESULT_COPY_FACTOR
+
+def _trim_batch(batch, sizes, room: int):
+    """
+    只保留累計大小不超過 room 的前段資料列。
+    """
+    keep, total = 0, 0
+    while keep < len(batch) and total + sizes[keep] <= room:
+        total += sizes[keep]
+        keep += 1
+    return batch[:keep], sizes[:keep]
+
+def _fetch_rows_within_budget(cursor, max_rows: int):
+    """
+    分批抓取資料並向全域預算登記，回傳 (rows, 已登記 bytes, 截斷說明或 None)。
+    只有在尚未持有任何預算時 (第一批) 才會等待，並依第一批的平均列大小預估整個結果；
+    之後需要追加時不等待，預算不足就截斷結果，避免多個請求各自持有部分預算而互相卡住。
+    呼叫端必須在結果送出後以 result_budget.release() 釋放已登記的 bytes。
+    """
+    rows = []
+    reserved = 0
+    used = 0
+    message = None
+    try:
+        while len(rows) < max_rows and message is None:
+            requested = min(RESULT_FETCH_BATCH, max_rows - len(rows))
+            batch = cursor.fetchmany(requested)
+            if not batch:
+                break
+            sizes = [estimate_row_bytes(row) for row in batch]
+            if used + sum(sizes) > RESULT_MAX_BYTES:
+                batch, sizes = _trim_batch(batch, sizes, RESULT_MAX_BYTES - used)
+                message = f"查詢結果超過單次查詢記憶體上限 ({RESULT_MAX_BYTES / 1048576:.1f} MB)"
+
+            need = used + sum(sizes) - reserved
+            if need > 0 and reserved == 0:
+                expected = sum(sizes)
+                if len(batch) == requested and message is None:
+                    expected = min(RESULT_MAX_BYTES, expected * max_rows // len(batch))
+                reserved = result_budget.acquire(max(expected, need))
+            elif need > 0:
+                if result_budget.try_acquire(need):
+                    reserved += need
+                else:
+                    batch, sizes = _trim_batch(batch, sizes, reserved - used)
+                    message = "伺服器查詢結果記憶體預算不足"
+
+            used += sum(sizes)
+            rows.extend(batch)
+
+        # 歸還預估多出的部分
+        result_budget.release(reserved - used)
+        reserved = used
+    except BaseException:
+        result_budget.release(reserved)
+        raise
+    return rows, reserved, message
+
+# --- 3-2. 非同步查詢工作 (Job) ---
+# 長時間的報表查詢在背景執行緒中執行，結果逐批寫入暫存檔 (每行一筆 JSON 陣列)，
+# 前端透過 SSE 取得進度，完成後再分頁讀取或串流下載，避免單一 HTTP 請求逾時。
+
+_FINISHED_JOB_STATUSES = (JobStatus.DONE, JobStatus.ERROR, JobStatus.CANCELLED)
+
+class QueryJob:
+    """
+    一個背景查詢工作的狀態與暫存結果。
+    """
+    def __init__(self, sql: str, max_rows: int, db_type: DbType):
+        self.id = uuid.uuid4().hex
+        self.sql = sql
+        self.db_type = db_type
+        self.max_rows = max_rows
+        self.status = JobStatus.QUEUED
+        self.error: Optional[str] = None
+        self.columns: List[str] = []
+        self.rows_fetched = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.spill_path: Optional[str] = None
+        self.offsets: List[int] = []  # 第 i * JOB_INDEX_STRIDE 筆資料在暫存檔中的位移
+        self.cancel_requested = False
+        self.discarded = False
+        self.connection = None  # 執行中的連線與游標，供取消查詢使用
+        self.cursor = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in _FINISHED_JOB_STATUSES
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        return self.finished_at + JOB_TTL_SECONDS if self.finished_at else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status.value,
+            "rows_fetched": self.rows_fetched,
+            "elapsed": round(self.elapsed, 3),
+            "columns": self.columns,
+            "error": self.error,
+            "expires_at": self.expires_at,
+        }
+
+_jobs: Dict[str, QueryJob] = {}
+# 背景執行緒尚未結束的工作 (包含已被刪除、正在取消中的工作)，用來計算同時執行上限
+_unfinished_jobs: Dict[str, QueryJob] = {}
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_CONCURRENT, thread_name_prefix="query-job")
+
+def _remove_spill_file(job: QueryJob):
+    if job.spill_path and os.path.exists(job.spill_path):
+        try:
+            os.remove(job.spill_path)
+        except OSError as e:
+            logging.warning(f"Could not remove spill file {job.spill_path}: {e}")
+
+def _run_query_job(job: QueryJob, query: JobQuery):
+    """
+    在背景執行緒中執行查詢，並把結果逐批寫入暫存檔。
+    """
+    if job.cancel_requested:
+        with _jobs_lock:
+            job.status = JobStatus.CANCELLED
+            job.finished_at = time.time()
+            _unfinished_jobs.pop(job.id, None)
+        return
+    job.status = JobStatus.RUNNING
+    job.started_at = time.time()
+    status = JobStatus.DONE
+    try:
+        fd, job.spill_path = tempfile.mkstemp(prefix="websql_job_", suffix=".jsonl", dir=JOB_SPILL_DIR)
+        with os.fdopen(fd, "wb") as spill, get_db_engine(query) as connection:
+            with connection.cursor() as cursor:
+                with _jobs_lock:
+                    job.connection, job.cursor = connection, cursor
+                if job.cancel_requested:
+                    raise HTTPException(status_code=400, detail="查詢工作已取消。")
+                execute_sql(cursor, query)
+                job.columns = [col[0] for col in cursor.description] if cursor.description else []
+                while job.rows_fetched < job.max_rows:
+                    if job.cancel_requested:
+                        status = JobStatus.CANCELLED
+                        break
+                    rows = cursor.fetchmany(min(JOB_FETCH_BATCH, job.max_rows - job.rows_fetched))
+                    if not rows:
+                        break
+                    # 每批寫入暫存檔前先登記預算，預算用盡時暫停抓取
+                    reserved = result_budget.acquire(sum(estimate_row_bytes(row) for row in rows))
+                    try:
+                        for row in rows:
+                            if job.rows_fetched % JOB_INDEX_STRIDE == 0:
+                                job.offsets.append(spill.tell())
+                            line = json.dumps(jsonable_encoder(list(row)), ensure_ascii=False)
+                            spill.write(line.encode("utf-8") + b"\n")
+                            job.rows_fetched += 1
+                    finally:
+                        result_budget.release(reserved)
+    except HTTPException as e:
+        status = JobStatus.CANCELLED if job.cancel_requested else JobStatus.ERROR
+        job.error = e.detail
+    except Exception as e:
+        # 被取消的查詢會由驅動程式拋出中斷錯誤
+        status = JobStatus.CANCELLED if job.cancel_requested else JobStatus.ERROR
+        job.error = f"查詢執行失敗: {e}"
+        if status == JobStatus.ERROR:
+            logging.error(f"Query job {job.id} failed: {e}")
+    finally:
+        with _jobs_lock:
+            job.status = status
+            job.finished_at = time.time()
+            job.connection = job.cursor = None
+            _unfinished_jobs.pop(job.id, None)
+            if job.discarded:
+                _remove_spill_file(job)
+        logging.info(f"Query job {job.id} {status.value}: {job.rows_fetched} rows in {job.elapsed:.2f}s")
+
+def _cancel_running_query(job: QueryJob, connection, cursor):
+    """
+    中斷執行中的查詢：oracledb 與 psycopg2 使用 connection.cancel()，pyodbc 使用 cursor.cancel()。
+    """
+    try:
+        if job.db_type == DbType.MSSQL:
+            cursor.cancel()
+        else:
+            connection.cancel()
+        logging.info(f"Query job {job.id} cancel sent to database.")
+    except Exception as e:
+        logging.warning(f"Could not cancel query job {job.id}: {e}")
+
+def _discard_job(job: QueryJob):
+    """
+    移除工作；執行中的工作會要求資料庫中斷查詢，暫存檔由背景執行緒結束時刪除。
+    工作在背景執行緒結束前仍計入同時執行上限。
+    """
+    with _jobs_lock:
+        _jobs.pop(job.id, None)
+        job.cancel_requested = True
+        job.discarded = True
+        if job.finished:
+            _remove_spill_file(job)
+        connection, cursor = job.connection, job.cursor
+    if connection is not None:
+        _cancel_running_query(job, connection, cursor)
+
+def _cleanup_expired_jobs():
+    now = time.time()
+    for job in list(_jobs.values()):
+        if job.expires_at is not None and job.expires_at <= now:
+            logging.info(f"Query job {job.id} expired, cleaning up.")
+            _discard_job(job)
+
+def _get_job(job_id: str) -> QueryJob:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"找不到查詢工作 {job_id}，可能已過期或被刪除。")
+    return job
+
+def _require_finished_job(job_id: str) -> QueryJob:
+    job = _get_job(job_id)
+    if job.status == JobStatus.ERROR:
+        raise HTTPException(status_code=400, detail=job.error)
+    if job.status == JobStatus.CANCELLED:
+        raise HTTPException(status_code=410, detail=f"查詢工作 {job_id} 已取消，沒有可讀取的結果。")
+    if job.status != JobStatus.DONE:
+        raise HTTPException(status_code=409, detail=f"查詢工作尚未完成 (目前狀態: {job.status.value})。")
+    return job
+
+def _open_spill_file(job: QueryJob):
+    """
+    開啟工作的暫存檔；工作可能在查詢狀態之後才被 DELETE 或過期清理刪除，此時回傳 410。
+    """
+    try:
+        if job.discarded:
+            raise FileNotFoundError(job.spill_path)
+        return open(job.spill_path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail=f"查詢工作 {job.id} 的結果已被刪除或過期。")
+
+def _read_job_rows(job: QueryJob, offset: int, limit: int) -> List[list]:
+    """
+    從暫存檔讀取 [offset, offset + limit) 範圍的資料列。
+    """
+    if offset >= job.rows_fetched:
+        return []
+    rows = []
+    with _open_spill_file(job) as spill:
+        spill.seek(job.offsets[offset // JOB_INDEX_STRIDE])
+        for _ in range(offset % JOB_INDEX_STRIDE):
+            spill.readline()
+        for _ in range(min(limit, job.rows_fetched - offset)):
+            rows.append(json.loads(spill.readline()))
+    return rows
+
+async def _job_janitor():
+    while True:
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+        await asyncio.to_thread(_cleanup_expired_jobs)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    janitor = asyncio.create_task(_job_janitor())
+    yield
+    janitor.cancel()
+    for job in list(_jobs.values()):
+        _discard_job(job)
+    _job_executor.shutdown(wait=False, cancel_futures=True)
+    _query_executor.shutdown(wait=False, cancel_futures=True)
+
+# 同步查詢可能在 result_budget.acquire 等待最多 RESULT_BUDGET_WAIT 秒，使用專用且有上限的執行緒池，
+# 預算用盡時排隊的是這裡的查詢，而不是 asyncio 預設執行緒池裡的其他端點 (例如 /jobs/{id}/result)
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_MAX_WORKERS, thread_name_prefix="sql-query")
+
+def _run_sql_query(query: SQLQuery) -> JSONResponse:
+    """
+    在工作執行緒中執行查詢；記憶體預算在回應送出後才釋放。
+    """
+    validate_read_only_sql(query.sql, query.db_type)
+
+    reserved = 0
+    response = None
+    try:
+        with get_db_engine(query) as connection:
+            with connection.cursor() as cursor:
+                execute_sql(cursor, query)
+                columns = [col[0] for col in cursor.description] if cursor.description else []
+                rows, reserved, truncated_reason = _fetch_rows_within_budget(cursor, query.max_rows)
+        result_data = [dict(zip(columns, row)) for row in rows]
+        payload = {
+            "status": "success",
+            "row_count": len(result_data),
+            "columns": columns,
+            "data": result_data,
+        }
+        if truncated_reason:
+            payload["truncated"] = True
+            payload["message"] = f"{truncated_reason}，僅回傳前 {len(result_data)} 筆資料。"
+            logging.warning(f"Query result truncated at {len(result_data)} rows ({reserved} bytes): {truncated_reason}")
+        response = BudgetedJSONResponse(jsonable_encoder(payload), reserved)
+        return response
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"查詢執行失敗: {e}")
+    finally:
+        if response is None:
+            result_budget.release(reserved)
+
 # --- 4. FastAPI 應用程式實例 ---
 app = FastAPI(
     title="DB Web Query Tool API",
-    description="一個純粹的資料庫查詢代理 API，不處理任何設定檔儲存。"
+    description="一個純粹的資料庫查詢代理 API，不處理任何設定檔儲存。",
+    lifespan=lifespan
 )
 
 # --- 5. API Endpoints ---
@@ -165,26 +876,113 @@ async def execute_sql_query(query: SQLQuery = Body(...)):
     """
     在指定的資料庫上執行 SQL 查詢，並包含安全檢查。
     """
-    # 【安全檢查】在執行任何操作前，先驗證 SQL 語句
-    validate_read_only_sql(query.sql)
-    
-    try:
-        with get_db_engine(query) as connection:
-            with connection.cursor() as cursor:
-                cursor.execute(query.sql)
-                columns = [col[0] for col in cursor.description] if cursor.description else []
-                rows = cursor.fetchmany(query.max_rows)
-                result_data = [dict(zip(columns, row)) for row in rows]
-                return {
-                    "status": "success",
-                    "row_count": len(result_data),
-                    "columns": columns,
-                    "data": result_data,
-                }
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"查詢執行失敗: {e}")
+    # 資料庫驅動皆為同步 API，放到工作執行緒以免阻塞其他請求 (也讓記憶體預算的等待不會卡住事件迴圈)；
+    # 【安全檢查】SQL 驗證也在工作執行緒中、執行任何操作前進行
+    return await asyncio.get_running_loop().run_in_executor(_query_executor, _run_sql_query, query)
+
+@app.get("/metrics/memory", tags=["Monitoring"])
+async def memory_metrics():
+    """
+    回傳目前在途查詢結果的記憶體用量與預算，供監控使用。
+    """
+    return result_budget.snapshot()
+
+@app.post("/jobs", tags=["Jobs"])
+async def submit_query_job(query: JobQuery = Body(...)):
+    """
+    提交背景查詢工作，立即回傳 job_id；查詢結果會暫存到磁碟。
+    """
+    # 大型 SQL 的檢查需要數毫秒，不在事件迴圈上執行
+    await asyncio.to_thread(validate_read_only_sql, query.sql, query.db_type)
+
+    with _jobs_lock:
+        if len(_unfinished_jobs) >= JOB_MAX_CONCURRENT:
+            raise HTTPException(status_code=429, detail=f"執行中的查詢工作已達上限 ({JOB_MAX_CONCURRENT})，請稍後再試。")
+        job = QueryJob(query.sql, query.max_rows, query.db_type)
+        _jobs[job.id] = job
+        _unfinished_jobs[job.id] = job
+
+    _job_executor.submit(_run_query_job, job, query)
+    logging.info(f"Query job {job.id} submitted.")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_query_job(job_id: str):
+    """
+    取得查詢工作的目前狀態。
+    """
+    return _get_job(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events", tags=["Jobs"])
+async def query_job_events(job_id: str):
+    """
+    以 Server-Sent Events 推送查詢進度 (已抓取筆數、耗時)，工作結束時送出最終狀態後關閉。
+    """
+    job = _get_job(job_id)
+
+    async def event_stream():
+        while True:
+            # 狀態只讀取一次：事件名稱與是否結束必須依同一份快照判斷，否則工作恰好在兩次讀取之間
+            # 結束時，會送出 progress 後就關閉串流，前端收不到最終狀態
+            snapshot = job.to_dict()
+            finished = JobStatus(snapshot["status"]) in _FINISHED_JOB_STATUSES
+            event = snapshot["status"] if finished else "progress"
+            yield f"event: {event}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+@app.get("/jobs/{job_id}/result", tags=["Jobs"])
+async def get_query_job_result(job_id: str, offset: int = 0, limit: int = 200):
+    """
+    分頁讀取已完成工作的結果，回傳格式與 /execute-query 相同。
+    """
+    job = _require_finished_job(job_id)
+    if offset < 0 or not 0 < limit <= 10000:
+        raise HTTPException(status_code=400, detail="offset 不可小於 0，limit 需介於 1 到 10000。")
+    rows = await asyncio.to_thread(_read_job_rows, job, offset, limit)
+    return {
+        "status": "success",
+        "row_count": len(rows),
+        "total_rows": job.rows_fetched,
+        "offset": offset,
+        "columns": job.columns,
+        "data": [dict(zip(job.columns, row)) for row in rows],
+    }
+
+@app.get("/jobs/{job_id}/download", tags=["Jobs"])
+async def download_query_job_result(job_id: str):
+    """
+    以串流方式下載已完成工作的完整結果，不需一次載入記憶體。
+    """
+    job = _require_finished_job(job_id)
+    # 先開啟暫存檔，檔案已被刪除時才能回傳 410 而不是在串流中途失敗；開啟後即使被刪除仍可讀完
+    spill_file = await asyncio.to_thread(_open_spill_file, job)
+
+    def stream():
+        head = {"status": "success", "row_count": job.rows_fetched, "columns": job.columns}
+        yield json.dumps(head, ensure_ascii=False)[:-1] + ', "data": ['
+        with spill_file as spill:
+            for i, line in enumerate(spill):
+                row = dict(zip(job.columns, json.loads(line)))
+                yield ("," if i else "") + json.dumps(row, ensure_ascii=False)
+        yield "]}"
+
+    headers = {"Content-Disposition": f'attachment; filename="job_{job.id}.json"'}
+    return StreamingResponse(stream(), media_type="application/json", headers=headers)
+
+@app.delete("/jobs/{job_id}", tags=["Jobs"])
+async def delete_query_job(job_id: str):
+    """
+    取消執行中的工作或刪除已完成的工作與其暫存檔。
+    """
+    job = _get_job(job_id)
+    # 取消查詢需要與資料庫溝通 (psycopg2 會另開連線送出取消要求)，不在事件迴圈上執行
+    await asyncio.to_thread(_discard_job, job)
+    return {"status": "success", "message": f"查詢工作 {job_id} 已刪除。"}
 
 # --- 6. 前端靜態檔案服務 ---
 @app.get("/", include_in_schema=False)
@@ -1,14 +1,28 @@
 /**
  * RSFormat.js - 零依賴的資料庫結果集格式化庫（完整版）
- * 版本: 2.3.0
+ * 版本: 2.4.0
  * 作者: Claude Code / Gemini
  * 描述: 將資料庫查詢結果格式化為多種顯示格式，並包含完整的 UI 控制器、排序與篩選功能
  *       只需一行程式碼即可創建完整的結果展示介面
+ *       大量資料時：篩選、排序、轉置、Rowspan 分組與 CSV 產生在 Web Worker 中處理，
+ *       表格與 Row Set 只把可視範圍內的資料列放進 DOM（虛擬捲動）
  */
 
 (function(global) {
     'use strict';
 
+    const DEFAULTS = {
+        virtual: 'auto',          // true / false / 'auto'（超過 virtualThreshold 筆時啟用）
+        virtualThreshold: 500,
+        viewportHeight: 600,      // 虛擬捲動區塊高度 (px)
+        rowHeight: 37,            // 表格列高預估值 (px)，首次渲染後依實際高度校正
+        overscan: 10,             // 可視範圍上下多渲染的列數
+        useWorker: true,
+        workerThreshold: 2000     // 超過此筆數才交給 Web Worker，避免小資料的傳遞延遲
+    };
+
+    const ROWSET_LINE_HEIGHT = 21;
+
     // ==================== 工具函數 ====================
 
     function escapeHtml(value) {
@@ -33,25 +47,256 @@
         return Object.keys(data[0]);
     }
 
-    function addIdColumn(data) {
-        return data.map((row, index) => ({
-            ID: index + 1,
-            ...row
-        }));
+    function downloadCsv(csvContent, filename) {
+        const blob = new Blob(['\ufeff' + csvContent], { type: 'text/csv;charset=utf-8;' });
+        const link = document.createElement('a');
+        const url = URL.createObjectURL(blob);
+
+        link.setAttribute('href', url);
+        link.setAttribute('download', filename);
+        link.style.visibility = 'hidden';
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+    }
+
+    // ==================== 資料處理（主執行緒或 Web Worker）====================
+
+    // 注意：此函數會被轉成字串在 Web Worker 中執行，內部不可引用外部變數。
+    // 資料以欄位順序的陣列保存（compact row arrays），不再為每列建立物件。
+    function createDataProcessor() {
+        const datasets = new Map();
+
+        function compareValues(valA, valB, direction) {
+            if (valA === valB) return 0;
+            if (valA === null || valA === undefined) return 1;
+            if (valB === null || valB === undefined) return -1;
+
+            if (typeof valA === 'number' && typeof valB === 'number') {
+                return direction === 'asc' ? valA - valB : valB - valA;
+            }
+
+            const strA = String(valA).toLowerCase();
+            const strB = String(valB).toLowerCase();
+
+            if (strA < strB) return direction === 'asc' ? -1 : 1;
+            if (strA > strB) return direction === 'asc' ? 1 : -1;
+            return 0;
+        }
+
+        // 每個 rowspan 欄位一個 Int32Array：runs[i] = 從第 i 列起連續相同值的列數
+        function computeSpans(rows, spanCount) {
+            const spans = [];
+            for (let j = 0; j < spanCount; j++) {
+                const runs = new Int32Array(rows.length);
+                for (let i = rows.length - 1; i >= 0; i--) {
+                    runs[i] = (i < rows.length - 1 && rows[i + 1][j] === rows[i][j]) ? runs[i + 1] + 1 : 1;
+                }
+                spans.push(runs);
+            }
+            return spans;
+        }
+
+        function computeWidths(columns, rows) {
+            const widths = columns.map(c => String(c).length);
+            rows.forEach(row => {
+                for (let i = 0; i < columns.length; i++) {
+                    const len = String(row[i] ?? '').length;
+                    if (len > widths[i]) widths[i] = len;
+                }
+            });
+            return widths;
+        }
+
+        function transpose(columns, rows) {
+            if (columns.length === 0 || rows.length === 0) {
+                return { headers: [], bodyData: [] };
+            }
+            const headers = [columns[0], ...rows.map(row => row[0] ?? '')];
+            const bodyData = columns.slice(1).map((col, j) => [col, ...rows.map(row => row[j + 1] ?? '')]);
+            return { headers, bodyData };
+        }
+
+        function toJson(columns, rows) {
+            const objects = rows.map(row => {
+                const obj = {};
+                columns.forEach((col, i) => { obj[col] = row[i]; });
+                return obj;
+            });
+            return JSON.stringify(objects, null, 2);
+        }
+
+        function toCsv(columns, rows) {
+            const quote = v => `"${String(v ?? '').replace(/"/g, '""')}"`;
+            const lines = [columns.map(quote).join(',')];
+            rows.forEach(row => lines.push(row.map(quote).join(',')));
+            return lines.join('\r\n') + '\r\n';
+        }
+
+        function load(key, columns, data) {
+            const rows = data.map(row => columns.map(col => row[col]));
+            datasets.set(key, { columns, rows });
+            return { rowCount: rows.length };
+        }
+
+        function drop(key) {
+            datasets.delete(key);
+        }
+
+        // opts: { format, filter, showId, transpose, rowspan, sortColumn, sortDirection }
+        function process(key, opts) {
+            const dataset = datasets.get(key);
+            if (!dataset) throw new Error(`找不到資料集 ${key}`);
+
+            let columns = dataset.columns;
+            let rows = dataset.rows;
+
+            // 1. 篩選（轉置模式使用未篩選的完整資料）
+            if (opts.filter && !opts.transpose) {
+                const filter = opts.filter;
+                rows = rows.filter(row => row.some(value => String(value).toLowerCase().includes(filter)));
+            }
+
+            // 2. 增加 ID 欄位
+            if (opts.showId) {
+                rows = rows.map((row, index) => [index + 1, ...row]);
+                columns = ['ID', ...columns];
+            }
+
+            if (opts.transpose) {
+                const transposed = transpose(columns, rows);
+                return { columns: transposed.headers, rows: transposed.bodyData, count: rows.length };
+            }
+
+            // 3. 排序
+            const sortIndex = opts.sortColumn ? columns.indexOf(opts.sortColumn) : -1;
+            if (sortIndex >= 0 && opts.sortDirection !== 'none') {
+                if (rows === dataset.rows) rows = rows.slice();
+                rows.sort((a, b) => compareValues(a[sortIndex], b[sortIndex], opts.sortDirection));
+            }
+
+            switch (opts.format) {
+                case 'table':
+                    return { columns, rows, count: rows.length, spans: computeSpans(rows, Math.min(opts.rowspan || 0, columns.length)) };
+                case 'rowset':
+                    return { columns, rows, count: rows.length, widths: computeWidths(columns, rows) };
+                case 'json':
+                    return { count: rows.length, text: toJson(columns, rows) };
+                case 'csv':
+                    return { count: rows.length, text: toCsv(columns, rows) };
+                default:
+                    throw new Error(`不支援的格式: ${opts.format}`);
+            }
+        }
+
+        return { load, drop, process };
+    }
+
+    const localProcessor = createDataProcessor();
+
+    let sharedWorker = null;   // null: 尚未建立, false: 無法使用
+    let workerSeq = 0;
+    let datasetSeq = 0;
+    const pendingCalls = new Map();
+
+    function failPendingCalls(error) {
+        pendingCalls.forEach(({ reject }) => reject(error));
+        pendingCalls.clear();
     }
 
-    function transposeData(columns, data) {
-        if (!columns || columns.length === 0 || !data || data.length === 0) {
-            return { headers: [], bodyData: [] };
+    function getWorker() {
+        if (sharedWorker !== null) return sharedWorker || null;
+        if (typeof Worker === 'undefined' || typeof Blob === 'undefined' || typeof URL === 'undefined') {
+            sharedWorker = false;
+            return null;
+        }
+
+        // 以 Blob URL 建立內嵌 Worker，不需要額外的 .js 檔案
+        const source = `
+            const processor = (${createDataProcessor.toString()})();
+            self.onmessage = function (e) {
+                const { id, type, args } = e.data;
+                try {
+                    const result = processor[type](...args);
+                    const transfer = result && result.spans ? result.spans.map(runs => runs.buffer) : [];
+                    self.postMessage({ id, result }, transfer);
+                } catch (err) {
+                    self.postMessage({ id, error: String((err && err.message) || err) });
+                }
+            };
+        `;
+
+        try {
+            const url = URL.createObjectURL(new Blob([source], { type: 'application/javascript' }));
+            sharedWorker = new Worker(url);
+        } catch (err) {
+            // 例如 CSP 禁止 blob: Worker，改在主執行緒處理
+            sharedWorker = false;
+            return null;
         }
 
-        const firstColumnName = columns[0];
-        const newHeaders = [firstColumnName, ...data.map(row => row[firstColumnName] ?? '')];
-        const newBodyData = columns.slice(1).map(colName => {
-            return [colName, ...data.map(row => row[colName] ?? '')];
+        sharedWorker.onmessage = (e) => {
+            const { id, result, error } = e.data;
+            const call = pendingCalls.get(id);
+            if (!call) return;
+            pendingCalls.delete(id);
+            if (error) call.reject(new Error(error));
+            else call.resolve(result);
+        };
+        sharedWorker.onerror = (e) => {
+            e.preventDefault();
+            sharedWorker.terminate();
+            sharedWorker = false;
+            failPendingCalls(new Error(e.message || 'Web Worker 無法執行'));
+        };
+
+        return sharedWorker;
+    }
+
+    function postToWorker(worker, type, args) {
+        return new Promise((resolve, reject) => {
+            // Worker 已因錯誤終止時，postMessage 不會有回應，必須立即失敗
+            if (worker !== sharedWorker) {
+                reject(new Error('Web Worker 已終止'));
+                return;
+            }
+            const id = ++workerSeq;
+            pendingCalls.set(id, { resolve, reject });
+            worker.postMessage({ id, type, args });
         });
+    }
 
-        return { headers: newHeaders, bodyData: newBodyData };
+    // 為一份資料集選擇處理位置：資料量大時交給 Worker，Worker 失敗則自動改用主執行緒
+    function createRunner(rowCount, options) {
+        const key = 'ds-' + (++datasetSeq);
+        const useWorker = options.useWorker !== false && rowCount >= (options.workerThreshold ?? DEFAULTS.workerThreshold);
+        let worker = useWorker ? getWorker() : null;
+        let loadArgs = null;
+
+        // 改用主執行緒時，把資料重新載入本地處理器
+        function fallBackToLocal(type, reason) {
+            console.warn('RSFormat: Web Worker 無法使用，改用主執行緒', reason);
+            worker = null;
+            if (type !== 'load' && type !== 'drop' && loadArgs) localProcessor.load(key, ...loadArgs);
+        }
+
+        return {
+            async call(type, ...args) {
+                if (type === 'load') loadArgs = args;
+                if (worker && worker !== sharedWorker) {
+                    // 共用 Worker 在此 runner 沒有進行中的呼叫時已終止
+                    fallBackToLocal(type, 'Web Worker 已終止');
+                }
+                if (worker) {
+                    try {
+                        return await postToWorker(worker, type, [key, ...args]);
+                    } catch (err) {
+                        fallBackToLocal(type, err);
+                    }
+                }
+                return localProcessor[type](key, ...args);
+            }
+        };
     }
 
     // ==================== 樣式注入 ====================
@@ -258,6 +503,37 @@
                 padding: 1rem;
                 margin: 1rem 0;
             }
+            .rsformat-viewport {
+                overflow: auto;
+                border: 1px solid #dee2e6;
+                border-radius: 4px;
+            }
+
+            .rsformat-viewport .rsformat-table {
+                margin-top: 0;
+            }
+
+            .rsformat-virtual td {
+                white-space: nowrap;
+                overflow: hidden;
+                text-overflow: ellipsis;
+                max-width: 400px;
+            }
+
+            .rsformat-virtual .rsformat-spacer td {
+                padding: 0;
+                border: 0;
+            }
+
+            .rsformat-viewport.rsformat-rowset {
+                padding: 0 1rem;
+            }
+
+            .rsformat-virtual-lines {
+                margin: 0;
+                font: inherit;
+                line-height: 21px;
+            }
         `;
 
         document.head.appendChild(style);
@@ -265,133 +541,201 @@
 
     // ==================== 渲染函數 ====================
 
-    function renderRowSet(container, columns, data) {
-        let text = `查詢成功，共回傳 ${data.length} 筆資料。\n\n`;
-
-        const colWidths = columns.map(c => String(c).length);
-        data.forEach(row => {
-            columns.forEach((col, i) => {
-                const val = String(row[col] ?? '');
-                if (val.length > colWidths[i]) {
-                    colWidths[i] = val.length;
-                }
-            });
-        });
+    function buildRowSetHeader(columns, rowCount, widths) {
+        return [
+            `查詢成功，共回傳 ${rowCount} 筆資料。`,
+            '',
+            columns.map((c, i) => String(c).padEnd(widths[i])).join(' | '),
+            columns.map((c, i) => '-'.repeat(widths[i])).join('-|-')
+        ];
+    }
 
-        text += columns.map((c, i) => String(c).padEnd(colWidths[i])).join(' | ') + '\n';
-        text += columns.map((c, i) => '-'.repeat(colWidths[i])).join('-|-') + '\n';
+    function formatRowSetLine(row, widths) {
+        return widths.map((width, i) => String(row[i] ?? '').padEnd(width)).join(' | ');
+    }
 
-        data.forEach(row => {
-            text += columns.map((c, i) => String(row[c] ?? '').padEnd(colWidths[i])).join(' | ') + '\n';
-        });
+    function renderRowSet(container, columns, rows, widths) {
+        const lines = buildRowSetHeader(columns, rows.length, widths);
+        rows.forEach(row => lines.push(formatRowSetLine(row, widths)));
+        const text = lines.join('\n') + '\n';
 
         container.innerHTML = `<div class="rsformat-container"><pre class="rsformat-rowset">${escapeHtml(text)}</pre></div>`;
     }
 
-    function renderHtmlTable(container, columns, data, rowspanCount, useBr, formatter) {
-        let tableHtml = '<div class="rsformat-container">';
-        tableHtml += '<table class="rsformat-table"><thead><tr>';
-
-        const sortState = formatter.sortState || {};
+    function buildTableHead(columns, sortState, isSortable) {
+        const parts = ['<thead><tr>'];
 
         columns.forEach(col => {
-            const isSortable = formatter.options.format === 'table';
             const thClass = isSortable ? 'sortable' : '';
             const dataAttr = isSortable ? `data-column="${escapeHtml(col)}"` : '';
-            
+
             let indicator = '';
             if (isSortable && col === sortState.column) {
                 if (sortState.direction === 'asc') indicator = '<span class="sort-indicator">▲</span>';
                 if (sortState.direction === 'desc') indicator = '<span class="sort-indicator">▼</span>';
             }
 
-            tableHtml += `<th class="${thClass}" ${dataAttr}>${escapeHtml(col)}${indicator}</th>`;
+            parts.push(`<th class="${thClass}" ${dataAttr}>${escapeHtml(col)}${indicator}</th>`);
         });
-        tableHtml += '</tr></thead><tbody>';
-
-        if (data.length === 0) {
-            tableHtml += `<tr><td colspan="${columns.length}" style="text-align: center;">沒有符合篩選條件的資料</td></tr>`;
-        } else if (rowspanCount > 0 && data.length > 0) {
-            const lastValues = new Array(rowspanCount).fill(null);
-
-            for (let i = 0; i < data.length; i++) {
-                tableHtml += '<tr>';
 
-                for (let j = 0; j < columns.length; j++) {
-                    const col = columns[j];
-                    const isSpanCol = j < rowspanCount;
-                    const cellValue = data[i][col];
+        parts.push('</tr></thead>');
+        return parts.join('');
+    }
 
-                    if (isSpanCol && i > 0 && cellValue === lastValues[j]) {
-                        continue;
-                    }
+    // 產生 [start, end) 範圍的資料列；spans 為 rowspan 欄位的連續列數，
+    // 範圍起點落在分組中間時，該格會從起點重新開始合併
+    function buildTableRows(rows, columnCount, spans, start, end, useBr) {
+        const parts = [];
 
-                    if (isSpanCol) {
-                        lastValues[j] = cellValue;
-                    }
+        for (let i = start; i < end; i++) {
+            const row = rows[i];
+            parts.push('<tr class="rsformat-row">');
 
-                    let span = 1;
-                    if (isSpanCol) {
-                        for (let k = i + 1; k < data.length; k++) {
-                            if (data[k][col] === cellValue) {
-                                span++;
-                            } else {
-                                break;
-                            }
-                        }
-                    }
+            for (let j = 0; j < columnCount; j++) {
+                let rowspanAttr = '';
 
-                    const displayValue = useBr ? convertNewlineToBr(cellValue) : escapeHtml(cellValue);
-                    const rowspanAttr = span > 1 ? ` rowspan="${span}"` : '';
-                    tableHtml += `<td${rowspanAttr}>${displayValue}</td>`;
+                if (j < spans.length) {
+                    const runs = spans[j];
+                    const isGroupStart = i === start || runs[i - 1] !== runs[i] + 1;
+                    if (!isGroupStart) continue;
+                    const span = Math.min(runs[i], end - i);
+                    if (span > 1) rowspanAttr = ` rowspan="${span}"`;
                 }
 
-                tableHtml += '</tr>';
+                const displayValue = useBr ? convertNewlineToBr(row[j]) : escapeHtml(row[j]);
+                parts.push(`<td${rowspanAttr}>${displayValue}</td>`);
             }
+
+            parts.push('</tr>');
+        }
+
+        return parts.join('');
+    }
+
+    function renderHtmlTable(container, columns, rows, spans, useBr, sortState, isSortable) {
+        let body;
+        if (rows.length === 0) {
+            body = `<tr><td colspan="${columns.length}" style="text-align: center;">沒有符合篩選條件的資料</td></tr>`;
         } else {
-            data.forEach(row => {
-                tableHtml += '<tr>';
-                columns.forEach(col => {
-                    const displayValue = useBr ? convertNewlineToBr(row[col]) : escapeHtml(row[col]);
-                    tableHtml += `<td>${displayValue}</td>`;
-                });
-                tableHtml += '</tr>';
-            });
+            body = buildTableRows(rows, columns.length, spans, 0, rows.length, useBr);
         }
 
-        tableHtml += '</tbody></table></div>';
-        container.innerHTML = tableHtml;
+        container.innerHTML = '<div class="rsformat-container"><table class="rsformat-table">' +
+            buildTableHead(columns, sortState, isSortable) +
+            `<tbody>${body}</tbody></table></div>`;
     }
 
     function renderTransposedTable(container, headers, bodyData, useBr) {
-        let tableHtml = '<div class="rsformat-container">';
-        tableHtml += '<table class="rsformat-table"><thead><tr>';
+        const parts = ['<div class="rsformat-container"><table class="rsformat-table"><thead><tr>'];
 
         headers.forEach(header => {
-            tableHtml += `<th>${escapeHtml(header)}</th>`;
+            parts.push(`<th>${escapeHtml(header)}</th>`);
         });
-        tableHtml += '</tr></thead><tbody>';
+        parts.push('</tr></thead><tbody>');
 
         bodyData.forEach(rowDataArray => {
-            tableHtml += '<tr>';
+            parts.push('<tr>');
             rowDataArray.forEach(cellData => {
                 const displayValue = useBr ? convertNewlineToBr(cellData) : escapeHtml(cellData);
-                tableHtml += `<td>${displayValue}</td>`;
+                parts.push(`<td>${displayValue}</td>`);
             });
-            tableHtml += '</tr>';
+            parts.push('</tr>');
         });
 
-        tableHtml += '</tbody></table></div>';
-        container.innerHTML = tableHtml;
+        parts.push('</tbody></table></div>');
+        container.innerHTML = parts.join('');
     }
 
-    function renderJson(container, data) {
-        const jsonText = JSON.stringify(data, null, 2);
+    function renderJson(container, jsonText) {
         container.innerHTML = `<div class="rsformat-container"><pre class="rsformat-json">${escapeHtml(jsonText)}</pre></div>`;
     }
 
+    function spacerRow(height, colspan) {
+        return height > 0 ? `<tr class="rsformat-spacer"><td colspan="${colspan}" style="height: ${height}px;"></td></tr>` : '';
+    }
+
+    // 虛擬捲動：固定高度的捲動區塊內，只渲染可視範圍（加上 overscan）的資料列，
+    // 上下以等高的空白區塊撐出完整捲軸長度。虛擬表格的儲存格固定單行顯示。
+    function renderVirtual(container, kind, result, options, sortState, isSortable) {
+        const { columns, rows } = result;
+        const isTable = kind === 'table';
+        const headerLines = isTable ? [] : buildRowSetHeader(columns, rows.length, result.widths);
+        const total = headerLines.length + rows.length;
+        const overscan = options.overscan;
+        let itemHeight = isTable ? options.rowHeight : ROWSET_LINE_HEIGHT;
+
+        if (isTable) {
+            container.innerHTML = '<div class="rsformat-container">' +
+                `<div class="rsformat-viewport" style="max-height: ${options.viewportHeight}px;">` +
+                '<table class="rsformat-table rsformat-virtual">' +
+                buildTableHead(columns, sortState, isSortable) +
+                '<tbody></tbody></table></div></div>';
+        } else {
+            container.innerHTML = '<div class="rsformat-container">' +
+                `<div class="rsformat-viewport rsformat-rowset" style="max-height: ${options.viewportHeight}px;">` +
+                '<div></div><pre class="rsformat-virtual-lines"></pre><div></div></div></div>';
+        }
+
+        const viewport = container.querySelector('.rsformat-viewport');
+        const tbody = viewport.querySelector('tbody');
+        const [topSpacer, linesPre, bottomSpacer] = isTable ? [] : viewport.children;
+        let rangeStart = -1;
+        let rangeEnd = -1;
+
+        const update = () => {
+            const viewportHeight = viewport.clientHeight || options.viewportHeight;
+            const first = Math.floor(viewport.scrollTop / itemHeight);
+            const start = Math.max(0, first - overscan);
+            const end = Math.min(total, first + Math.ceil(viewportHeight / itemHeight) + overscan);
+            if (start === rangeStart && end === rangeEnd) return;
+            rangeStart = start;
+            rangeEnd = end;
+
+            if (isTable) {
+                tbody.innerHTML = spacerRow(start * itemHeight, columns.length) +
+                    buildTableRows(rows, columns.length, result.spans, start, end, false) +
+                    spacerRow((total - end) * itemHeight, columns.length);
+            } else {
+                const lines = [];
+                for (let k = start; k < end; k++) {
+                    lines.push(k < headerLines.length ? headerLines[k] : formatRowSetLine(rows[k - headerLines.length], result.widths));
+                }
+                topSpacer.style.height = `${start * itemHeight}px`;
+                linesPre.textContent = lines.join('\n');
+                bottomSpacer.style.height = `${(total - end) * itemHeight}px`;
+            }
+        };
+
+        let ticking = false;
+        viewport.addEventListener('scroll', () => {
+            if (ticking) return;
+            ticking = true;
+            requestAnimationFrame(() => {
+                ticking = false;
+                update();
+            });
+        });
+
+        update();
+
+        // 依實際列高校正預估值，之後的渲染沿用校正後的高度
+        if (isTable) {
+            const firstRow = tbody.querySelector('tr.rsformat-row');
+            const measured = firstRow ? firstRow.getBoundingClientRect().height : 0;
+            if (measured > 0 && Math.abs(measured - itemHeight) > 0.5) {
+                itemHeight = measured;
+                options.rowHeight = measured;
+                rangeStart = rangeEnd = -1;
+                update();
+            }
+        }
+    }
+
     // ==================== RSFormatter 類 ====================
 
+    // 每個容器元素目前掛載的 formatter；同一元素建立新的 formatter 時，釋放舊的資料集
+    const mountedFormatters = new WeakMap();
+
     class RSFormatter {
         constructor(selector, data, options) {
             this.selector = selector;
@@ -404,11 +748,20 @@
                 showId: options?.showId || false,
                 transpose: options?.transpose || false,
                 rowspan: options?.rowspan ?? 3,
-                newlineToBr: options?.newlineToBr !== false
+                newlineToBr: options?.newlineToBr !== false,
+                virtual: options?.virtual ?? DEFAULTS.virtual,
+                virtualThreshold: options?.virtualThreshold ?? DEFAULTS.virtualThreshold,
+                viewportHeight: options?.viewportHeight ?? DEFAULTS.viewportHeight,
+                rowHeight: options?.rowHeight ?? DEFAULTS.rowHeight,
+                overscan: options?.overscan ?? DEFAULTS.overscan,
+                useWorker: options?.useWorker ?? DEFAULTS.useWorker,
+                workerThreshold: options?.workerThreshold ?? DEFAULTS.workerThreshold
             };
 
             this.sortState = { column: null, direction: 'none' }; // none, asc, desc
             this.filterText = '';
+            this.renderToken = 0;
+            this.runner = null;
 
             this.container = null;
             this.controlsContainer = null;
@@ -420,6 +773,12 @@
             this.init();
         }
 
+        loadData() {
+            if (this.runner) this.runner.call('drop');
+            this.runner = createRunner(this.originalData.length, this.options);
+            this.loaded = this.runner.call('load', this.originalColumns, this.originalData);
+        }
+
         init() {
             const element = document.querySelector(this.selector);
             if (!element) {
@@ -427,6 +786,11 @@
                 return;
             }
 
+            const previous = mountedFormatters.get(element);
+            if (previous && previous !== this) previous.releaseData();
+            mountedFormatters.set(element, this);
+            this.loadData();
+
             element.innerHTML = '';
             element.className = 'rsformat-wrapper';
 
@@ -613,59 +977,56 @@
             this.render();
         }
 
-        getProcessedData() {
-            let columns = [...this.originalColumns];
-            let data = [...this.originalData];
-
-            // 1. 篩選
-            if (this.filterText) {
-                const filter = this.filterText;
-                data = data.filter(row => {
-                    return Object.values(row).some(value => 
-                        String(value).toLowerCase().includes(filter)
-                    );
-                });
-            }
-
-            // 2. 增加 ID 欄位
-            if (this.options.showId) {
-                data = addIdColumn(data);
-                columns = ['ID', ...columns];
-            }
-
-            // 3. 排序
+        getProcessOptions(format) {
             const { column, direction } = this.sortState;
-            if (this.options.format === 'table' && direction !== 'none' && column) {
-                data.sort((a, b) => {
-                    const valA = a[column];
-                    const valB = b[column];
+            return {
+                format,
+                filter: this.filterText,
+                showId: this.options.showId,
+                transpose: format !== 'csv' && this.options.transpose,
+                rowspan: this.options.rowspan,
+                sortColumn: this.options.format === 'table' ? column : null,
+                sortDirection: direction
+            };
+        }
 
-                    if (valA === valB) return 0;
-                    if (valA === null || valA === undefined) return 1;
-                    if (valB === null || valB === undefined) return -1;
+        useVirtual(rowCount) {
+            const virtual = this.options.virtual;
+            return virtual === true || (virtual === 'auto' && rowCount > this.options.virtualThreshold);
+        }
 
-                    if (typeof valA === 'number' && typeof valB === 'number') {
-                        return direction === 'asc' ? valA - valB : valB - valA;
-                    }
+        async render() {
+            if (!this.runner) return;
+            const token = ++this.renderToken;
 
-                    const strA = String(valA).toLowerCase();
-                    const strB = String(valB).toLowerCase();
+            if (!this.originalData || this.originalData.length === 0) {
+                if (this.infoDisplay) this.infoDisplay.textContent = '共 0 筆資料';
+                this.resultContainer.innerHTML = '<div class="rsformat-error">沒有資料可顯示</div>';
+                return;
+            }
 
-                    if (strA < strB) return direction === 'asc' ? -1 : 1;
-                    if (strA > strB) return direction === 'asc' ? 1 : -1;
-                    return 0;
-                });
+            const format = this.options.format;
+            if (!['table', 'rowset', 'json'].includes(format)) {
+                this.resultContainer.innerHTML = `<div class="rsformat-error">不支援的格式: ${escapeHtml(format)}</div>`;
+                return;
             }
 
-            return { processedData: data, columns };
-        }
+            let result;
+            try {
+                await this.loaded;
+                result = await this.runner.call('process', this.getProcessOptions(format));
+            } catch (err) {
+                if (token !== this.renderToken) return;
+                this.resultContainer.innerHTML = `<div class="rsformat-error">資料處理失敗: ${escapeHtml(err.message || err)}</div>`;
+                return;
+            }
 
-        render() {
-            const { processedData, columns } = this.getProcessedData();
+            // 處理期間若已有新的 render（例如連續輸入搜尋字），捨棄舊結果
+            if (token !== this.renderToken) return;
 
             if (this.infoDisplay) {
                 const total = this.originalData.length;
-                const shown = processedData.length;
+                const shown = result.count;
                 if (total === shown) {
                     this.infoDisplay.textContent = `共 ${total} 筆資料`;
                 } else {
@@ -673,65 +1034,30 @@
                 }
             }
 
-            if (!this.originalData || this.originalData.length === 0) {
-                this.resultContainer.innerHTML = '<div class="rsformat-error">沒有資料可顯示</div>';
-                return;
-            }
+            const isSortable = format === 'table';
 
             if (this.options.transpose) {
-                // 轉置模式下，使用未篩選的完整資料，但仍套用ID選項
-                let originalCols = [...this.originalColumns];
-                let originalProcData = [...this.originalData];
-                if (this.options.showId) {
-                    originalProcData = addIdColumn(originalProcData);
-                    originalCols = ['ID', ...originalCols];
-                }
-                const transposed = transposeData(originalCols, originalProcData);
-                renderTransposedTable(this.resultContainer, transposed.headers, transposed.bodyData, this.options.newlineToBr);
+                renderTransposedTable(this.resultContainer, result.columns, result.rows, this.options.newlineToBr);
+            } else if (format === 'json') {
+                renderJson(this.resultContainer, result.text);
+            } else if (result.rows.length > 0 && this.useVirtual(result.rows.length)) {
+                renderVirtual(this.resultContainer, format, result, this.options, this.sortState, isSortable);
+            } else if (format === 'rowset') {
+                renderRowSet(this.resultContainer, result.columns, result.rows, result.widths);
             } else {
-                switch (this.options.format) {
-                    case 'rowset':
-                        renderRowSet(this.resultContainer, columns, processedData);
-                        break;
-                    case 'table':
-                        renderHtmlTable(this.resultContainer, columns, processedData, this.options.rowspan, this.options.newlineToBr, this);
-                        break;
-                    case 'json':
-                        renderJson(this.resultContainer, processedData);
-                        break;
-                    default:
-                        this.resultContainer.innerHTML = `<div class="rsformat-error">不支援的格式: ${this.options.format}</div>`;
-                }
+                renderHtmlTable(this.resultContainer, result.columns, result.rows, result.spans, this.options.newlineToBr, this.sortState, isSortable);
             }
-            
+
             this.attachTableEventListeners();
         }
 
-        exportCsv(filename) {
+        async exportCsv(filename) {
             filename = filename || 'export_' + new Date().toISOString().slice(0,10) + '.csv';
 
-            const { processedData, columns } = this.getProcessedData();
-
-            let csvContent = '';
-            csvContent += columns.map(h => `"${String(h ?? '').replace(/"/g, '""')}"`).join(',') + '\r\n';
-
-            processedData.forEach(row => {
-                csvContent += columns.map(col => {
-                    const value = String(row[col] ?? '').replace(/"/g, '""');
-                    return `"${value}"`;
-                }).join(',') + '\r\n';
-            });
-
-            const blob = new Blob(['\ufeff' + csvContent], { type: 'text/csv;charset=utf-8;' });
-            const link = document.createElement('a');
-            const url = URL.createObjectURL(blob);
-
-            link.setAttribute('href', url);
-            link.setAttribute('download', filename);
-            link.style.visibility = 'hidden';
-            document.body.appendChild(link);
-            link.click();
-            document.body.removeChild(link);
+            if (!this.runner) return;
+            await this.loaded;
+            const result = await this.runner.call('process', this.getProcessOptions('csv'));
+            downloadCsv(result.text, filename);
         }
 
         setData(data, columns) {
@@ -740,12 +1066,22 @@
             this.sortState = { column: null, direction: 'none' };
             this.filterText = '';
             if (this.searchInput) this.searchInput.value = '';
+            this.loadData();
             this.render();
         }
 
+        // 釋放 Worker 或主執行緒中保存的資料集，之後此 formatter 不再渲染
+        releaseData() {
+            this.renderToken++;
+            if (this.runner) this.runner.call('drop');
+            this.runner = null;
+        }
+
         destroy() {
+            this.releaseData();
             const element = document.querySelector(this.selector);
             if (element) {
+                if (mountedFormatters.get(element) === this) mountedFormatters.delete(element);
                 element.innerHTML = '';
             }
         }
@@ -760,7 +1096,7 @@
         return new RSFormatter(selector, data, options);
     }
 
-    function exportCsv(data, filename, options) {
+    async function exportCsv(data, filename, options) {
         options = options || {};
         filename = filename || 'export.csv';
 
@@ -769,34 +1105,16 @@
             return;
         }
 
-        let columns = options.columns || extractColumns(data);
-        let processedData = data;
+        const columns = options.columns || extractColumns(data);
+        const runner = createRunner(data.length, options);
 
-        if (options.showId) {
-            processedData = addIdColumn(processedData);
-            columns = ['ID', ...columns];
+        try {
+            await runner.call('load', columns, data);
+            const result = await runner.call('process', { format: 'csv', showId: !!options.showId });
+            downloadCsv(result.text, filename);
+        } finally {
+            runner.call('drop');
         }
-
-        let csvContent = '';
-        csvContent += columns.map(h => `"${String(h ?? '').replace(/"/g, '""')}"`).join(',') + '\r\n';
-
-        processedData.forEach(row => {
-            csvContent += columns.map(col => {
-                const value = String(row[col] ?? '').replace(/"/g, '""');
-                return `"${value}"`;
-            }).join(',') + '\r\n';
-        });
-
-        const blob = new Blob(['\ufeff' + csvContent], { type: 'text/csv;charset=utf-8;' });
-        const link = document.createElement('a');
-        const url = URL.createObjectURL(blob);
-
-        link.setAttribute('href', url);
-        link.setAttribute('download', filename);
-        link.style.visibility = 'hidden';
-        document.body.appendChild(link);
-        link.click();
-        document.body.removeChild(link);
     }
 
     // ==================== 匯出到全域 ====================
@@ -811,7 +1129,7 @@
         render: render,
         exportCsv: exportCsv,
 
-        version: '2.3.0'
+        version: '2.4.0'
     };
 
     if (typeof module !== 'undefined' && module.exports) {
@@ -0,0 +1,531 @@
+import os
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from main import DbType, JobStatus, lex_sql, prepare_binds, validate_read_only_sql
+
+
+def assert_rejected(sql, db_type):
+    with pytest.raises(HTTPException) as exc_info:
+        validate_read_only_sql(sql, db_type)
+    assert exc_info.value.status_code == 400
+
+
+# --- 唯讀檢查：跨語句注入 ---
+
+@pytest.mark.parametrize("sql, db_type", [
+    ("SELECT $$'$$; DELETE FROM t; --'", DbType.POSTGRES),
+    ("SELECT $q$'$q$; DELETE FROM t; --'", DbType.POSTGRES),
+    ("SELECT E'\\''; DELETE FROM t; --'", DbType.POSTGRES),
+    ("SELECT (ARRAY[1])[length(']')]; DELETE FROM t --'", DbType.POSTGRES),
+    ("SELECT 1 /* /* */ ' */; DELETE FROM t; --'", DbType.POSTGRES),
+    ("SELECT 1 AS [a]]']; DELETE FROM t; --']", DbType.MSSQL),
+    ("SELECT 1 /* /* */ ' */; DELETE FROM t; --'", DbType.MSSQL),
+    ("SELECT q'[ ' ]' FROM dual; DELETE FROM t; --'", DbType.ORACLE),
+])
+def test_rejects_statement_hidden_by_dialect_quoting(sql, db_type):
+    assert_rejected(sql, db_type)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 'abc",
+    'SELECT "abc',
+    "SELECT 1 /* abc",
+    "SELECT `a` FROM t",
+])
+@pytest.mark.parametrize("db_type", list(DbType))
+def test_rejects_unterminated_or_unknown_quoting(sql, db_type):
+    if db_type == DbType.SQLITE and sql.startswith("SELECT `"):
+        pytest.skip("SQLite 支援反引號識別字")
+    assert_rejected(sql, db_type)
+
+
+@pytest.mark.parametrize("sql, db_type", [
+    ("SELECT $$abc", DbType.POSTGRES),
+    ("SELECT $tag$abc$$", DbType.POSTGRES),
+    ("SELECT 1 /* /* */", DbType.POSTGRES),
+    ("SELECT [abc", DbType.MSSQL),
+    ("SELECT [a]]", DbType.MSSQL),
+])
+def test_rejects_unterminated_dialect_quoting(sql, db_type):
+    assert_rejected(sql, db_type)
+
+
+@pytest.mark.parametrize("sql, db_type", [
+    ("SELECT 'a;b', \"c;d\" FROM t; SELECT 2", DbType.ORACLE),
+    ("SELECT 1 FROM v$session -- ; DELETE", DbType.ORACLE),
+    ("SELECT q'{it's; DELETE}' FROM dual", DbType.ORACLE),
+    ("SELECT $$; DELETE FROM t$$, $x$ $$ ; $x$", DbType.POSTGRES),
+    ("SELECT E'it\\'s; DELETE', a$b$c FROM t", DbType.POSTGRES),
+    ("SELECT (ARRAY[1,2])[1], x::text FROM t; WITH a AS (SELECT 1) SELECT * FROM a", DbType.POSTGRES),
+    ("SELECT 1 /* /* ; DELETE */ */", DbType.POSTGRES),
+    ("SELECT [a]];DELETE] FROM t; USE db", DbType.MSSQL),
+])
+def test_allows_read_only_sql(sql, db_type):
+    validate_read_only_sql(sql, db_type)
+
+
+@pytest.mark.parametrize("sql, db_type", [
+    ("SELECT " + "q'x " * 50000, DbType.ORACLE),
+    ("SELECT " + "x q'x 'a' " * 20000, DbType.ORACLE),
+    ("SELECT " + "$a$ " * 50001, DbType.POSTGRES),
+    ("SELECT 1 " + "/* " * 50000, DbType.POSTGRES),
+])
+def test_unterminated_quotes_are_rejected_in_linear_time(sql, db_type):
+    started = time.perf_counter()
+    assert_rejected(sql, db_type)
+    assert lex_sql(sql, db_type).error
+    assert time.perf_counter() - started < 1
+
+
+def test_verdict_cache_keeps_only_the_verdict():
+    sql = "SELECT " + ", ".join(f"'v{i}'" for i in range(1000)) + " FROM t"
+    validate_read_only_sql(sql, DbType.ORACLE)
+    assert_rejected(sql + "; DELETE FROM t", DbType.ORACLE)
+    assert all(value is None or isinstance(value, str) for value in main._verdict_cache.values())
+
+
+def test_lexer_is_dialect_aware():
+    sql = "SELECT arr[:idx] FROM t"
+    assert [t.kind for t in lex_sql(sql, DbType.POSTGRES).tokens] == ["bind"]
+    assert [t.kind for t in lex_sql(sql, DbType.MSSQL).tokens] == ["ident"]
+
+
+# --- 綁定變數轉換 ---
+
+def test_prepare_binds_postgres():
+    sql, params = prepare_binds("SELECT '%' || :a, $$:b$$ FROM t WHERE x = :a", DbType.POSTGRES, {"a": 1})
+    assert sql == "SELECT '%%' || %(a)s, $$:b$$ FROM t WHERE x = %(a)s"
+    assert params == {"a": 1}
+
+
+def test_prepare_binds_mssql_positional_order():
+    sql, params = prepare_binds("SELECT :b, [:a], :a, :b", DbType.MSSQL, {"a": 1, "b": 2})
+    assert sql == "SELECT ?, [:a], ?, ?"
+    assert params == [2, 1, 2]
+
+
+def test_prepare_binds_missing_value():
+    with pytest.raises(HTTPException) as exc_info:
+        prepare_binds("SELECT :a, :b", DbType.POSTGRES, {"a": 1})
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.parametrize("sql, db_type, params", [
+    ("SELECT ':a' FROM t", DbType.POSTGRES, {"a": 1}),
+    ("SELECT [:a] FROM t", DbType.MSSQL, {"a": 1}),
+    ("SELECT :a FROM t", DbType.MSSQL, {"a": 1, "b": 2}),
+    ("SELECT :a FROM dual -- :b", DbType.ORACLE, {"a": 1, "b": 2}),
+    ("SELECT :a FROM dual", DbType.ORACLE, [1, 2]),
+])
+def test_prepare_binds_rejects_unplaced_params(sql, db_type, params):
+    with pytest.raises(HTTPException) as exc_info:
+        prepare_binds(sql, db_type, params)
+    assert exc_info.value.status_code == 400
+
+
+def test_prepare_binds_oracle_passthrough():
+    sql = "SELECT :Id, ':x' FROM dual WHERE id = :id"
+    assert prepare_binds(sql, DbType.ORACLE, {"ID": 1}) == (sql, {"ID": 1})
+
+
+def test_prepare_binds_postgres_array_subscript():
+    assert prepare_binds("SELECT arr[:idx] FROM t", DbType.POSTGRES, {"idx": 1}) == ("SELECT arr[%(idx)s] FROM t", {"idx": 1})
+
+
+@pytest.mark.parametrize("db_type, expected", [
+    (DbType.POSTGRES, ("SELECT %(2)s, %(1)s, %(2)s", {"2": "b", "1": "a"})),
+    (DbType.MSSQL, ("SELECT ?, ?, ?", ["b", "a", "b"])),
+    (DbType.ORACLE, ("SELECT :2, :1, :2", {"1": "a", "2": "b"})),
+])
+def test_prepare_binds_list_params_bind_by_number(db_type, expected):
+    assert prepare_binds("SELECT :2, :1, :2", db_type, ["a", "b"]) == expected
+
+
+@pytest.mark.parametrize("db_type", list(DbType))
+def test_prepare_binds_list_params_require_numeric_placeholders(db_type):
+    with pytest.raises(HTTPException) as exc_info:
+        prepare_binds("SELECT :a, :b FROM t", db_type, [1, 2])
+    assert exc_info.value.status_code == 400
+
+
+def test_prepare_binds_postgres_array_slice():
+    sql = "SELECT arr[1:2], arr[:a] FROM t WHERE x LIKE 'a%'"
+    assert prepare_binds(sql, DbType.POSTGRES, {"a": 3}) == (
+        "SELECT arr[1:2], arr[%(a)s] FROM t WHERE x LIKE 'a%%'", {"a": 3}
+    )
+    assert prepare_binds("SELECT arr[1:2] FROM t", DbType.POSTGRES, None) == ("SELECT arr[1:2] FROM t", None)
+    with pytest.raises(HTTPException):
+        prepare_binds("SELECT arr[1:2] FROM t", DbType.POSTGRES, {"2": ""})
+
+
+# --- 非同步查詢工作 ---
+
+QUERY = {"hostname": "db", "sid": "orcl", "user": "scott", "pwd": "tiger", "db_type": "ORA", "sql": "SELECT id, name FROM t"}
+
+
+class FakeCursor:
+    """
+    以記憶體中的資料列模擬資料庫游標；hold 未放行前 fetchmany 會卡住，模擬長時間查詢。
+    interruptible=False 時 cancel() 只記錄收到取消要求，查詢要等 hold 放行後才結束 (例如驅動程式反應較慢)。
+    """
+
+    def __init__(self, rows, hold=None, interruptible=True, fail_after=None):
+        self.rows = list(rows)
+        self.hold = hold
+        self.interruptible = interruptible
+        self.fail_after = fail_after
+        self.fetches = 0
+        self.cancelled = threading.Event()
+        self.description = [("ID",), ("NAME",)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        if self.hold is not None:
+            self.hold.wait(5)
+        if self.cancelled.is_set():
+            raise RuntimeError("query cancelled")
+        self.fetches += 1
+        if self.fail_after is not None and self.fetches > self.fail_after:
+            raise RuntimeError("connection lost")
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.hold is not None and self.interruptible:
+            self.hold.set()
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self._cursor
+
+    def cancel(self):
+        self._cursor.cancel()
+
+
+def make_rows(count):
+    return [(i, f"name{i}") for i in range(count)]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "JOB_SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "JOB_PROGRESS_INTERVAL", 0)
+    # 不啟動 lifespan：其結束時會關閉模組層級的 executor，過期清理由測試直接呼叫
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """設定之後每個查詢使用的游標，回傳建立游標的函式。"""
+    cursors = []
+
+    def use(rows, hold=None, **options):
+        cursor = FakeCursor(rows, hold, **options)
+        cursors.append(cursor)
+        return cursor
+
+    monkeypatch.setattr(main, "get_db_engine", lambda query: FakeConnection(cursors[-1]))
+    return use
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def wait_for_job(client, job_id):
+    wait_until(lambda: main._jobs[job_id].finished)
+    return client.get(f"/jobs/{job_id}").json()
+
+
+def test_cancelled_job_result_is_gone(client, fake_db):
+    hold = threading.Event()
+    cursor = fake_db(make_rows(10), hold)
+    job_id = client.post("/jobs", json=QUERY).json()["job_id"]
+    main._jobs[job_id].cancel_requested = True
+    cursor.cancel()
+
+    assert wait_for_job(client, job_id)["status"] == "cancelled"
+    assert client.get(f"/jobs/{job_id}/result").status_code == 410
+    assert client.get(f"/jobs/{job_id}/download").status_code == 410
+
+
+@pytest.mark.parametrize("path", ["result", "download"])
+def test_removed_spill_file_is_gone_not_500(client, fake_db, path):
+    fake_db(make_rows(10))
+    job_id = client.post("/jobs", json=QUERY).json()["job_id"]
+    job = main._jobs[job_id]
+    assert wait_for_job(client, job_id)["status"] == "done"
+
+    # 模擬在狀態檢查之後，DELETE 或過期清理刪除了暫存檔
+    os.remove(job.spill_path)
+    response = client.get(f"/jobs/{job_id}/{path}")
+    assert response.status_code == 410
+
+    main._discard_job(job)
+    assert client.get(f"/jobs/{job_id}/{path}").status_code == 404
+
+class FlippingJob(main.QueryJob):
+    """第一次讀取狀態時仍在執行，之後即已完成，模擬工作剛好在兩次讀取之間結束。"""
+    reads = 0
+
+    @property
+    def status(self):
+        self.reads += 1
+        return JobStatus.RUNNING if self.reads == 1 else JobStatus.DONE
+
+    @status.setter
+    def status(self, value):
+        pass
+
+
+def test_job_events_always_end_with_final_status(monkeypatch):
+    monkeypatch.setattr(main, "JOB_PROGRESS_INTERVAL", 0)
+    job = FlippingJob("SELECT 1 FROM dual", 10, DbType.ORACLE)
+    monkeypatch.setitem(main._jobs, job.id, job)
+
+    body = TestClient(main.app).get(f"/jobs/{job.id}/events").text
+
+    events = [line for line in body.splitlines() if line.startswith("event: ")]
+    assert events[-1] == "event: done"
+
+
+def test_job_result_pages_and_download(client, fake_db):
+    fake_db(make_rows(2500))
+    job_id = client.post("/jobs", json=QUERY).json()["job_id"]
+    assert wait_for_job(client, job_id)["rows_fetched"] == 2500
+
+    page = client.get(f"/jobs/{job_id}/result", params={"offset": 1999, "limit": 3}).json()
+    assert [row["ID"] for row in page["data"]] == [1999, 2000, 2001]
+    assert page["total_rows"] == 2500
+
+    download = client.get(f"/jobs/{job_id}/download").json()
+    assert download["row_count"] == len(download["data"]) == 2500
+
+
+def test_job_cap_still_applies_after_delete(client, fake_db, monkeypatch):
+    monkeypatch.setattr(main, "JOB_MAX_CONCURRENT", 2)
+    holds = [threading.Event() for _ in range(2)]
+    cursors = []
+    job_ids = []
+    for hold in holds:
+        cursors.append(fake_db(make_rows(10), hold, interruptible=False))
+        job_ids.append(client.post("/jobs", json=QUERY).json()["job_id"])
+    wait_until(lambda: all(main._jobs[job_id].cursor is not None for job_id in job_ids))
+
+    assert client.post("/jobs", json=QUERY).status_code == 429
+
+    # DELETE 送出取消要求並移除工作，但背景執行緒仍在執行，名額不可釋放
+    assert client.delete(f"/jobs/{job_ids[0]}").status_code == 200
+    assert cursors[0].cancelled.is_set()
+    assert client.get(f"/jobs/{job_ids[0]}").status_code == 404
+    assert client.post("/jobs", json=QUERY).status_code == 429
+
+    holds[0].set()
+    wait_until(lambda: job_ids[0] not in main._unfinished_jobs)
+    fake_db(make_rows(1))
+    third = client.post("/jobs", json=QUERY)
+    assert third.status_code == 200
+
+    holds[1].set()
+    wait_for_job(client, job_ids[1])
+    wait_for_job(client, third.json()["job_id"])
+    assert not main._unfinished_jobs
+
+
+def test_delete_cancels_running_job_and_removes_spill_file(client, fake_db):
+    hold = threading.Event()
+    cursor = fake_db(make_rows(10), hold)
+    job_id = client.post("/jobs", json=QUERY).json()["job_id"]
+    job = main._jobs[job_id]
+    wait_until(lambda: job.cursor is not None)
+
+    assert client.delete(f"/jobs/{job_id}").status_code == 200
+    wait_until(lambda: job_id not in main._unfinished_jobs)
+
+    assert cursor.cancelled.is_set()
+    assert job.status == JobStatus.CANCELLED
+    assert not os.path.exists(job.spill_path)
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+
+
+def test_expired_jobs_are_cleaned_up(client, fake_db, monkeypatch):
+    fake_db(make_rows(5))
+    job_id = client.post("/jobs", json=QUERY).json()["job_id"]
+    wait_for_job(client, job_id)
+    job = main._jobs[job_id]
+
+    main._cleanup_expired_jobs()
+    assert job_id in main._jobs
+
+    monkeypatch.setattr(main, "JOB_TTL_SECONDS", 0)
+    main._cleanup_expired_jobs()
+    assert job_id not in main._jobs
+    assert not os.path.exists(job.spill_path)
+
+
+def test_failed_job_reports_error(client, fake_db):
+    fake_db(make_rows(3000), fail_after=1)
+    job_id = client.post("/jobs", json=QUERY).json()["job_id"]
+    job = wait_for_job(client, job_id)
+
+    assert job["status"] == "error"
+    assert "connection lost" in job["error"]
+    assert client.get(f"/jobs/{job_id}/result").status_code == 400
+    assert not main._unfinished_jobs
+
+
+# --- 查詢結果記憶體預算 ---
+
+def test_execute_query_runs_on_dedicated_executor(client, monkeypatch):
+    threads = []
+
+    def engine(query):
+        threads.append(threading.current_thread().name)
+        return FakeConnection(FakeCursor(make_rows(3)))
+
+    monkeypatch.setattr(main, "get_db_engine", engine)
+    response = client.post("/execute-query", json=QUERY)
+
+    assert response.status_code == 200
+    assert response.json()["row_count"] == 3
+    assert threads[0].startswith("sql-query")
+
+
+ROW = (1, "x" * 20)
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """換成獨立的預算，避免受其他測試影響；回傳 (預算, 單筆資料列的估計大小)。"""
+    fresh = main.MemoryBudget(10 * 1024 * 1024)
+    monkeypatch.setattr(main, "result_budget", fresh)
+    return fresh, main.estimate_row_bytes(ROW)
+
+
+def test_memory_budget_acquire_try_acquire_release():
+    budget = main.MemoryBudget(100)
+    assert budget.acquire(60, timeout=0.1) == 60
+    assert not budget.try_acquire(50)
+    assert budget.try_acquire(40)
+
+    with pytest.raises(HTTPException) as exc_info:
+        budget.acquire(1, timeout=0.05)
+    assert exc_info.value.status_code == 503
+    assert budget.snapshot()["rejected"] == 2
+
+    budget.release(100)
+    assert budget.acquire(500, timeout=0.1) == 100  # 單次登記不超過總預算
+    budget.release(100)
+    assert budget.snapshot()["used_bytes"] == 0
+    assert budget.snapshot()["peak_bytes"] == 100
+
+
+def test_memory_budget_wakes_waiter_on_release():
+    budget = main.MemoryBudget(100)
+    budget.acquire(100, timeout=0.1)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(budget.acquire(50, timeout=5)))
+    waiter.start()
+    wait_until(lambda: budget.snapshot()["waiting"] == 1)
+
+    budget.release(100)
+    waiter.join(5)
+    assert result == [50]
+    assert budget.snapshot()["used_bytes"] == 50
+
+
+def test_fetch_within_budget_reserves_actual_size(budget):
+    result_budget, row_bytes = budget
+    rows, reserved, message = main._fetch_rows_within_budget(FakeCursor([ROW] * 1200), 1200)
+
+    assert len(rows) == 1200 and message is None
+    assert reserved == 1200 * row_bytes == result_budget.snapshot()["used_bytes"]
+    result_budget.release(reserved)
+    assert result_budget.snapshot()["used_bytes"] == 0
+
+
+def test_fetch_within_budget_truncates_at_result_limit(budget, monkeypatch):
+    result_budget, row_bytes = budget
+    monkeypatch.setattr(main, "RESULT_MAX_BYTES", 100 * row_bytes)
+    rows, reserved, message = main._fetch_rows_within_budget(FakeCursor([ROW] * 1000), 1000)
+
+    assert len(rows) == 100
+    assert "上限" in message
+    assert reserved == 100 * row_bytes == result_budget.snapshot()["used_bytes"]
+    result_budget.release(reserved)
+    assert result_budget.snapshot()["used_bytes"] == 0
+
+
+def test_fetch_within_budget_truncates_instead_of_waiting_for_growth(budget, monkeypatch):
+    _, row_bytes = budget
+    result_budget = main.MemoryBudget(700 * row_bytes)
+    monkeypatch.setattr(main, "result_budget", result_budget)
+    monkeypatch.setattr(main, "RESULT_MAX_BYTES", 10000 * row_bytes)
+
+    # 第一批預估整個結果需要 1000 筆的空間，但只拿得到 700 筆；第二批追加失敗時直接截斷
+    started = time.monotonic()
+    rows, reserved, message = main._fetch_rows_within_budget(FakeCursor([ROW] * 1000), 1000)
+
+    assert time.monotonic() - started < 1
+    assert len(rows) == 700
+    assert "預算不足" in message
+    result_budget.release(reserved)
+    assert result_budget.snapshot()["used_bytes"] == 0
+
+
+def test_fetch_within_budget_releases_on_error(budget):
+    result_budget, _ = budget
+    with pytest.raises(RuntimeError):
+        main._fetch_rows_within_budget(FakeCursor([ROW] * 1200, fail_after=1), 1200)
+    assert result_budget.snapshot()["used_bytes"] == 0
+
+
+@pytest.mark.parametrize("max_bytes_rows, cursor_options, status, truncated", [
+    (None, {}, 200, False),
+    (50, {}, 200, True),
+    (None, {"fail_after": 0}, 400, False),
+])
+def test_execute_query_returns_budget_after_response(client, budget, monkeypatch,
+                                                     max_bytes_rows, cursor_options, status, truncated):
+    result_budget, row_bytes = budget
+    if max_bytes_rows:
+        monkeypatch.setattr(main, "RESULT_MAX_BYTES", max_bytes_rows * row_bytes)
+    monkeypatch.setattr(main, "get_db_engine", lambda query: FakeConnection(FakeCursor([ROW] * 200, **cursor_options)))
+
+    response = client.post("/execute-query", json=QUERY)
+
+    assert response.status_code == status
+    assert response.json().get("truncated", False) is truncated
+    if truncated:
+        assert response.json()["row_count"] == max_bytes_rows
+    assert result_budget.snapshot()["used_bytes"] == 0
+    assert client.get("/metrics/memory").json()["used_bytes"] == 0